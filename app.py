@@ -2,20 +2,36 @@
 import os
 import json
 import re
-import random
-import string
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, flash, url_for, jsonify, session
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from string import Template
+from datetime import datetime
+from flask import Flask, render_template, request, redirect, flash, url_for, jsonify, session, g
 from flask_session import Session
 from email.mime.text import MIMEText
-import smtplib
 from dotenv import load_dotenv
 from mobile_validate.validator import valid_number
-from redis_helper import redis_helper, cache_result, rate_limit, track_metric
-from functools import wraps
+from redis_helper import redis_helper, cache_result, rate_limit, track_metric, metric_periods
+from smtp_pool import SMTPPool
+from functools import lru_cache, wraps
+import hmac
+import hashlib
+import secrets
+import threading
+import time
 import bcrypt
 from typing import Optional, Dict, Any, Tuple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: counter file is used without locking
+    fcntl = None
+
 try:
     from mongo_helper import mongo_helper, migrate_json_to_mongo
     MONGO_AVAILABLE = True
@@ -29,8 +45,17 @@ load_dotenv()
 
 # Admin credentials (from environment)
 ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
+ADMIN_USERNAME_BYTES = ADMIN_USERNAME.encode('utf-8')
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")  # Plain password from environment
 ADMIN_PASSWORD_HASH = os.environ.get("ADMIN_PASSWORD_HASH")  # Pre-generated hash (optional)
+BCRYPT_COST = int(os.environ.get("BCRYPT_COST", "12"))  # bcrypt work factor (each +1 doubles verify time)
+
+def get_hash_cost(password_hash):
+    """Extract the bcrypt cost from a '$2b$NN$...' hash, or None if unparseable"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
 
 def get_or_create_admin_hash():
     """Get admin password hash from Redis/MongoDB or generate from plain password"""
@@ -45,10 +70,14 @@ def get_or_create_admin_hash():
         if redis_helper.is_available():
             stored_hash = redis_helper.get("admin:password_hash")
             if stored_hash:
-                return stored_hash.decode('utf-8') if isinstance(stored_hash, bytes) else stored_hash
+                stored_hash = stored_hash.decode('utf-8') if isinstance(stored_hash, bytes) else stored_hash
+                # Reuse the stored hash unless BCRYPT_COST has changed since it was generated
+                if get_hash_cost(stored_hash) == BCRYPT_COST:
+                    return stored_hash
+                print(f"🔁 BCRYPT_COST changed to {BCRYPT_COST}, regenerating admin password hash")
         
         # Generate new hash and store it
-        password_hash = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_COST)).decode('utf-8')
         
         # Store in Redis for future use
         if redis_helper.is_available():
@@ -70,12 +99,30 @@ def get_or_create_admin_hash():
         return password_hash
     
     # Fallback to default password
-    default_hash = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    default_hash = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_COST)).decode('utf-8')
     print("⚠️ WARNING: Using default admin password 'admin123'. Set ADMIN_PASSWORD in production!")
     return default_hash
 
 # Get the admin password hash (generated from plain password if needed)
 CURRENT_ADMIN_HASH = get_or_create_admin_hash()
+CURRENT_ADMIN_HASH_BYTES = CURRENT_ADMIN_HASH.encode('utf-8')
+
+# Checked against when the username is wrong so every attempt costs one bcrypt call
+DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=get_hash_cost(CURRENT_ADMIN_HASH) or BCRYPT_COST))
+
+# Verified Basic-auth passwords are cached briefly so scripted callers skip bcrypt
+BASIC_AUTH_CACHE_TTL = 60
+SERVER_PEPPER = (os.environ.get("FLASK_SECRET") or secrets.token_hex(32)).encode('utf-8')
+
+def basic_auth_cache_key(password_bytes):
+    """Redis key for a verified password, keyed by a peppered HMAC (never the password)"""
+    return f"basic_auth_ok:{hmac.new(SERVER_PEPPER, password_bytes, hashlib.sha256).hexdigest()}"
+
+# Time one verification so ops can tune BCRYPT_COST against the latency budget
+_bcrypt_start = time.perf_counter()
+bcrypt.checkpw(b"x", DUMMY_HASH)
+print(f"🔐 Admin auth bcrypt cost {get_hash_cost(CURRENT_ADMIN_HASH)}: "
+      f"{(time.perf_counter() - _bcrypt_start) * 1000:.0f}ms per verification")
 
 def require_admin_auth(f):
     """Decorator to require admin authentication for sensitive routes"""
@@ -85,11 +132,19 @@ def require_admin_auth(f):
         if not session.get('admin_authenticated'):
             # Check for basic auth header
             auth = request.authorization
-            if auth and auth.username == ADMIN_USERNAME and auth.password:
-                # Verify password using bcrypt
+            if auth and auth.password:
+                username_bytes = (auth.username or "").encode('utf-8')
                 password_bytes = auth.password.encode('utf-8')
-                hash_bytes = CURRENT_ADMIN_HASH.encode('utf-8')
-                if bcrypt.checkpw(password_bytes, hash_bytes):
+                # Constant-time username check; the cache lookup and, on a miss, bcrypt
+                # run for every username so neither leaks a timing oracle
+                user_ok = hmac.compare_digest(username_bytes, ADMIN_USERNAME_BYTES)
+                cache_key = basic_auth_cache_key(password_bytes)
+                cached = redis_helper.exists(cache_key)
+                if user_ok and cached:
+                    return f(*args, **kwargs)
+                password_ok = bcrypt.checkpw(password_bytes, CURRENT_ADMIN_HASH_BYTES if user_ok else DUMMY_HASH)
+                if user_ok and password_ok:
+                    redis_helper.set(cache_key, "1", ex=BASIC_AUTH_CACHE_TTL)
                     session['admin_authenticated'] = True
                     track_metric('admin_login_success')
                     return f(*args, **kwargs)
@@ -105,42 +160,113 @@ def require_admin_auth(f):
     return decorated_function
 
 # Initialize tracking system
-TRACKING_FILE = "submissions_tracking.json"
+TRACKING_FILE = "submissions_tracking.json"  # Legacy JSON dict, converted to the log below
+SUBMISSIONS_LOG_FILE = "submissions.jsonl"  # Append-only, one JSON record per line
+FALLBACK_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "submissions")  # Unsent declarations
+os.makedirs(FALLBACK_DIR, exist_ok=True)
+LAST_ID_FILE = "last_id.txt"  # Highest issued submission ID (JSON fallback counter)
+SUBMISSION_COUNTER_KEY = "submission:counter"
 
-def get_next_submission_id():
-    """Generate next submission ID using MongoDB or JSON fallback"""
+def convert_tracking_file():
+    """One-time conversion of the legacy JSON tracking dict into the JSONL log"""
+    if not os.path.exists(TRACKING_FILE) or os.path.exists(SUBMISSIONS_LOG_FILE):
+        return
     try:
-        if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available() and mongo_helper.db is not None:
-            # Use MongoDB to get next ID
-            last_submission = mongo_helper.db.submissions.find_one(
-                {}, 
-                sort=[("submission_id", -1)]
-            )
-            if last_submission:
-                last_id = int(last_submission.get("submission_id", "0"))
-            else:
-                last_id = 0
-            new_id = str(last_id + 1).zfill(6)
-            return new_id, {}
+        with open(TRACKING_FILE, 'r') as f:
+            tracking_data = json.load(f)
+        with open(SUBMISSIONS_LOG_FILE, 'w', encoding='utf-8') as f:
+            for sub_id in sorted(tracking_data, key=int):
+                record = {"submission_id": sub_id, **tracking_data[sub_id]}
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        print(f"Converted {len(tracking_data)} submissions from {TRACKING_FILE} to {SUBMISSIONS_LOG_FILE}")
+    except Exception as e:
+        print(f"Error converting tracking file: {e}")
+
+convert_tracking_file()
+
+def read_recent_logged_submissions(limit=50):
+    """Return the last `limit` records of the JSONL log, newest first"""
+    if not os.path.exists(SUBMISSIONS_LOG_FILE):
+        return []
+    with open(SUBMISSIONS_LOG_FILE, 'r', encoding='utf-8') as f:
+        tail = deque(f, maxlen=limit)
+    return [json.loads(line) for line in reversed(tail) if line.strip()]
+
+def find_logged_submission(submission_id):
+    """Find a submission in the JSONL log without parsing unrelated lines"""
+    if not os.path.exists(SUBMISSIONS_LOG_FILE):
+        return None
+    needle = f'"submission_id":"{submission_id}"'
+    with open(SUBMISSIONS_LOG_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            if needle in line:
+                record = json.loads(line)
+                if record.get("submission_id") == submission_id:
+                    return record
+    return None
+
+def advance_last_id(issued_id=None):
+    """Advance the file counter under a lock and return the new last ID
+
+    With no argument the counter is incremented; otherwise it is raised to
+    issued_id so IDs handed out via Redis are never reissued from the file.
+    """
+    with open(LAST_ID_FILE, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        content = f.read().strip()
+        if content:
+            last_id = int(content)
         else:
-            # Fallback to JSON file
-            if os.path.exists(TRACKING_FILE):
-                with open(TRACKING_FILE, 'r') as f:
-                    tracking_data = json.load(f)
-                last_id = max((int(x) for x in tracking_data.keys()), default=0)
-            else:
-                tracking_data = {}
-                last_id = 0
-            
-            # Generate new 6-digit ID
-            new_id = str(last_id + 1).zfill(6)
-            return new_id, tracking_data
+            # One-time seed from the newest logged submission
+            recent = read_recent_logged_submissions(1)
+            last_id = int(recent[0]["submission_id"]) if recent else 0
+        last_id = last_id + 1 if issued_id is None else max(last_id, issued_id)
+        f.seek(0)
+        f.truncate()
+        f.write(str(last_id))
+        return last_id
+
+def get_last_submission_id():
+    """Return the highest issued submission ID from MongoDB or the file counter"""
+    if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available() and mongo_helper.db is not None:
+        # Served by the unique submission_id index (IXSCAN, limit 1)
+        last_submission = mongo_helper.db.submissions.find_one(
+            {},
+            {"_id": 0, "submission_id": 1},
+            sort=[("submission_id", -1)]
+        )
+        return int(last_submission.get("submission_id", "0")) if last_submission else 0
+    return advance_last_id(0)
+
+def get_next_submission_id():
+    """Generate next submission ID using a Redis counter, MongoDB or the file counter"""
+    try:
+        mongo_ok = MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available()
+        
+        if redis_helper.is_available():
+            # Atomic counter, seeded once from the current max
+            if not redis_helper.exists(SUBMISSION_COUNTER_KEY):
+                redis_helper.set(SUBMISSION_COUNTER_KEY, get_last_submission_id(), nx=True)
+            new_id = redis_helper.incr(SUBMISSION_COUNTER_KEY)
+            if new_id is not None:
+                if not mongo_ok:
+                    advance_last_id(new_id)
+                return str(new_id).zfill(6)
+        
+        if mongo_ok:
+            return str(get_last_submission_id() + 1).zfill(6)
+        
+        # Fallback to the file counter
+        return str(advance_last_id()).zfill(6)
     except Exception as e:
         print(f"Error managing tracking: {e}")
-        return str(1).zfill(6), {}
+        return str(1).zfill(6)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET", "change-this-secret")
+app.config['SESSION_REDIS_POOL_SIZE'] = int(os.environ.get("SESSION_REDIS_POOL_SIZE", "32"))
 
 # Configure sessions with Redis (fixed implementation)
 try:
@@ -171,6 +297,9 @@ SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
 SMTP_USER = os.environ.get("SMTP_USER")  # your SMTP user (email)
 SMTP_PASS = os.environ.get("SMTP_PASS")  # your SMTP password or app password
 
+# Reuses logged-in SMTP connections across emails
+smtp_pool = SMTPPool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS)
+
 # Default recipient - where all form submissions are sent
 # This is the email address that receives all solemn declaration submissions
 # Set RECIPIENT_EMAIL environment variable to override the default
@@ -182,37 +311,42 @@ otp_resend_cooldown = {}
 
 def cleanup_old_data():
     """Clean up expired OTP data and old cooldown entries"""
-    current_time = datetime.now()
+    current_time = time.monotonic()
     
     if redis_helper.is_available():
         # Redis handles expiration automatically, just clean up fallback storage
         pass
     else:
-        # Clean up expired OTPs from in-memory storage
-        expired_emails = []
-        for email, data in otp_storage.items():
+        # Clean up expired OTPs from in-memory storage (iterate snapshots,
+        # request threads may mutate the dicts concurrently)
+        for email, data in list(otp_storage.items()):
             if current_time > data['expires_at']:
-                expired_emails.append(email)
-        
-        for email in expired_emails:
-            del otp_storage[email]
+                otp_storage.pop(email, None)
         
         # Clean up old cooldown entries (older than 1 hour)
-        old_cooldowns = []
-        for email, timestamp in otp_resend_cooldown.items():
-            if (current_time - timestamp).total_seconds() > 3600:  # 1 hour
-                old_cooldowns.append(email)
-        
-        for email in old_cooldowns:
-            del otp_resend_cooldown[email]
+        for email, timestamp in list(otp_resend_cooldown.items()):
+            if current_time - timestamp > 3600:  # 1 hour
+                otp_resend_cooldown.pop(email, None)
+
+def cleanup_worker():
+    """Run cleanup_old_data every 60 seconds off the request path"""
+    while True:
+        time.sleep(60)
+        try:
+            cleanup_old_data()
+        except Exception as e:
+            print(f"Error cleaning up OTP data: {e}")
+
+if not redis_helper.is_available():
+    threading.Thread(target=cleanup_worker, name="otp-cleanup", daemon=True).start()
 
 def generate_otp():
     """Generate a 6-digit OTP"""
-    return ''.join(random.choices(string.digits, k=6))
+    return f"{secrets.randbelow(1_000_000):06d}"
 
 def store_otp(email, otp):
     """Store OTP with expiration time (5 minutes) - Redis or fallback"""
-    expiration = datetime.now() + timedelta(minutes=5)
+    expiration = time.monotonic() + 300
     
     if redis_helper.is_available():
         # Store in Redis with automatic expiration
@@ -220,10 +354,9 @@ def store_otp(email, otp):
         data = {
             'otp': otp,
             'attempts': '0',
-            'created_at': datetime.now().isoformat()
+            'created_at': str(int(time.time()))
         }
-        redis_helper.hset(key, data)
-        redis_helper.expire(key, 300)  # 5 minutes
+        redis_helper.hset_with_expiry(key, data, 300)  # 5 minutes
         track_metric('otp_generated')
     else:
         # Fallback to in-memory storage
@@ -233,38 +366,40 @@ def store_otp(email, otp):
             'attempts': 0
         }
 
+# Atomically check an OTP: -1 = missing/expired, 0 = match (deleted),
+# n > 0 = failed attempts so far (deleted once the limit is reached)
+OTP_VERIFY_LUA = """
+local otp = redis.call('HGET', KEYS[1], 'otp')
+if not otp then return -1 end
+if otp == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts >= tonumber(ARGV[2]) then redis.call('DEL', KEYS[1]) end
+return attempts
+"""
+otp_verify_script = redis_helper.register_script(OTP_VERIFY_LUA)
+
 def verify_otp(email, submitted_otp):
     """Verify OTP and check if it's still valid - Redis or fallback"""
     if redis_helper.is_available():
-        # Redis implementation
+        # Redis implementation (single round-trip)
         key = f"otp:{email}"
-        if not redis_helper.exists(key):
+        result = redis_helper.run_script(otp_verify_script, [key], [submitted_otp, 3])
+        if result is None or result < 0:
             return False, "OTP not found or expired"
         
-        stored_otp = redis_helper.hget(key, 'otp')
-        attempts_str = redis_helper.hget(key, 'attempts', '0')
-        attempts = int(str(attempts_str)) if attempts_str else 0
-        
-        # Check if OTP matches BEFORE checking attempts
-        if stored_otp == submitted_otp:
-            redis_helper.delete(key)
+        if result == 0:
             track_metric('otp_verified_success')
             return True, "OTP verified successfully"
+        elif result >= 3:
+            track_metric('otp_too_many_attempts')
+            return False, "Too many incorrect attempts"
         else:
-            # Increment attempts after failed verification
-            new_attempts = attempts + 1
-            
-            # Check if this failed attempt exceeds the limit
-            if new_attempts >= 3:
-                redis_helper.delete(key)
-                track_metric('otp_too_many_attempts')
-                return False, "Too many incorrect attempts"
-            else:
-                # Still have attempts left, update the counter
-                redis_helper.hincrby(key, 'attempts', 1)
-                track_metric('otp_verification_failed')
-                remaining_attempts = 3 - new_attempts
-                return False, f"Invalid OTP. {remaining_attempts} attempt(s) remaining"
+            track_metric('otp_verification_failed')
+            remaining_attempts = 3 - result
+            return False, f"Invalid OTP. {remaining_attempts} attempt(s) remaining"
     else:
         # Fallback to in-memory storage
         if email not in otp_storage:
@@ -273,7 +408,7 @@ def verify_otp(email, submitted_otp):
         stored_data = otp_storage[email]
         
         # Check if OTP has expired
-        if datetime.now() > stored_data['expires_at']:
+        if time.monotonic() > stored_data['expires_at']:
             del otp_storage[email]
             return False, "OTP has expired"
         
@@ -283,13 +418,14 @@ def verify_otp(email, submitted_otp):
             return False, "Too many incorrect attempts"
         
         # Check if OTP matches
-        if stored_data['otp'] == submitted_otp:
+        if hmac.compare_digest(stored_data['otp'].encode('utf-8'), submitted_otp.encode('utf-8')):
             del otp_storage[email]
             return True, "OTP verified successfully"
         else:
             stored_data['attempts'] += 1
             return False, "Invalid OTP"
 
+@lru_cache(maxsize=4096)  # In-process layer; Redis is only consulted on a local miss
 @cache_result("phone_validation", expiration=3600)
 def validate_phone_number(phone, country="Greece"):
     """Cached phone number validation"""
@@ -300,10 +436,8 @@ def validate_phone_number(phone, country="Greece"):
     except Exception:
         return False
 
-def send_otp_email(email, otp):
-    """Send OTP to user's email"""
-    subject = "Κωδικός Επαλήθευσης - Verification Code"
-    body = f"""
+# Built once at import; send_otp_email only does a %-substitution
+OTP_EMAIL_TEMPLATE = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -315,7 +449,7 @@ def send_otp_email(email, otp):
     <p>Για να ολοκληρώσετε την υποβολή της φόρμας σας, παρακαλώ εισάγετε τον παρακάτω κωδικό επαλήθευσης:</p>
     
     <div style="background-color: #f5f5f5; border: 2px solid #007cba; border-radius: 8px; padding: 20px; text-align: center; margin: 20px 0;">
-        <h1 style="color: #007cba; margin: 0; font-size: 2.5em; letter-spacing: 0.2em;">{otp}</h1>
+        <h1 style="color: #007cba; margin: 0; font-size: 2.5em; letter-spacing: 0.2em;">%(otp)s</h1>
     </div>
     
     <p><strong>Σημαντικό:</strong> Αυτός ο κωδικός είναι έγκυρος για 5 λεπτά μόνο.</p>
@@ -327,12 +461,17 @@ def send_otp_email(email, otp):
 </body>
 </html>
 """
+
+def send_otp_email(email, otp):
+    """Send OTP to user's email"""
+    subject = "Κωδικός Επαλήθευσης - Verification Code"
+    body = OTP_EMAIL_TEMPLATE % {"otp": otp}
     
     send_email(subject, body, email)
     track_metric('otp_email_sent')
 
 # Simple utility to send email
-def send_email(subject: str, body: str, recipient: str = DEFAULT_RECIPIENT, is_html: bool = True) -> None:
+def send_email_direct(subject: str, body: str, recipient: str = DEFAULT_RECIPIENT, is_html: bool = True) -> None:
     msg = MIMEText(body, 'html' if is_html else 'plain', _charset="utf-8")
     msg["Subject"] = subject
     msg["From"] = SMTP_USER or f"no-reply@{os.getenv('COMPUTERNAME', 'localhost')}"
@@ -342,19 +481,80 @@ def send_email(subject: str, body: str, recipient: str = DEFAULT_RECIPIENT, is_h
         # If SMTP not configured, raise a helpful error
         raise RuntimeError("SMTP_USER and SMTP_PASS are not configured. See README / .env.example")
 
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
-        smtp.ehlo()
-        if SMTP_PORT in (587, 25):
-            smtp.starttls()
-            smtp.ehlo()
-        smtp.login(SMTP_USER, SMTP_PASS)
+    with smtp_pool.acquire() as smtp:
         smtp.sendmail(msg["From"], [recipient], msg.as_string())
 
+# Background OTP email delivery via a Redis list; declaration emails are sent inline
+# so a failure can still reach the user and the local fallback file
+EMAIL_QUEUE_KEY = "email_queue"
+
+def send_email(subject: str, body: str, recipient: str = DEFAULT_RECIPIENT, is_html: bool = True) -> None:
+    """Queue an email for the background worker, or send inline without Redis"""
+    if not SMTP_USER or not SMTP_PASS:
+        raise RuntimeError("SMTP_USER and SMTP_PASS are not configured. See README / .env.example")
+
+    job = json.dumps({"subject": subject, "body": body, "recipient": recipient, "is_html": is_html})
+    if redis_helper.is_available() and redis_helper.rpush(EMAIL_QUEUE_KEY, job):
+        return
+    send_email_direct(subject, body, recipient, is_html)
+
+def email_worker():
+    """Drain the email queue; a failed OTP email is dropped and the user can resend it"""
+    while True:
+        try:
+            item = redis_helper.redis_client.blpop(EMAIL_QUEUE_KEY, timeout=5)
+        except Exception as e:
+            print(f"Email queue unavailable: {e}")
+            time.sleep(5)
+            continue
+        if not item:
+            continue
+        _, payload = item
+        try:
+            job = json.loads(payload)
+            send_email_direct(job["subject"], job["body"], job["recipient"], job.get("is_html", True))
+        except Exception as e:
+            print(f"Error sending queued email: {e}")
+            track_metric('email_send_failed')
+
+if redis_helper.is_available():
+    threading.Thread(target=email_worker, name="email-worker", daemon=True).start()
+
+@app.before_request
+def set_metric_periods():
+    """Compute the metric day/hour keys once per request"""
+    g.metric_periods = metric_periods()
+
+# Pending form data lives in Redis; the session only carries its short ID
+FORM_DATA_TTL = 600  # 10 minutes
+
+def save_form_data(form_data):
+    """Store pending form data in Redis (session fallback) until OTP verification"""
+    clear_form_data()
+    if redis_helper.is_available():
+        form_id = secrets.token_urlsafe(16)
+        if redis_helper.set(f"form:{form_id}", json.dumps(form_data), ex=FORM_DATA_TTL):
+            session['form_id'] = form_id
+            return
+    session['form_data'] = form_data
+
+def load_form_data():
+    """Load pending form data, or None if it has expired"""
+    form_id = session.get('form_id')
+    if form_id:
+        stored = redis_helper.get(f"form:{form_id}")
+        return json.loads(stored) if stored else None
+    return session.get('form_data')
+
+def clear_form_data():
+    """Drop pending form data from Redis and the session"""
+    form_id = session.pop('form_id', None)
+    if form_id:
+        redis_helper.delete(f"form:{form_id}")
+    session.pop('form_data', None)
+
 @app.route("/", methods=["GET", "POST"])
 def index():
-    # Clean up expired data periodically
-    cleanup_old_data()
-    
     if request.method == "GET":
         return render_template("index.html", form={}, step="form")
         
@@ -368,14 +568,10 @@ def index():
         # Rate limit form submissions
         if redis_helper.is_available():
             rate_key = f"rate_limit:form:{client_ip}"
-            current = redis_helper.get(rate_key)
-            if current is None:
-                redis_helper.set(rate_key, 1, ex=3600)  # 1 hour window
-            elif current and int(str(current)) >= 10:  # Max 10 submissions per hour
+            count = redis_helper.incr_with_expiry(rate_key, 3600)  # 1 hour window
+            if count is not None and count > 10:  # Max 10 submissions per hour
                 flash("Πάρα πολλές προσπάθειες. Παρακαλώ δοκιμάστε αργότερα.", "error")
                 return render_template("index.html", form={}, step="form")
-            else:
-                redis_helper.incr(rate_key)
         
         # Step 1: Process initial form and send OTP
         return handle_form_submission()
@@ -383,14 +579,10 @@ def index():
         # Rate limit OTP attempts
         if redis_helper.is_available():
             otp_rate_key = f"rate_limit:otp:{client_ip}"
-            current = redis_helper.get(otp_rate_key)
-            if current is None:
-                redis_helper.set(otp_rate_key, 1, ex=300)  # 5 minute window
-            elif current and int(str(current)) >= 15:  # Max 15 OTP attempts per 5 minutes
+            count = redis_helper.incr_with_expiry(otp_rate_key, 300)  # 5 minute window
+            if count is not None and count > 15:  # Max 15 OTP attempts per 5 minutes
                 flash("Πάρα πολλές προσπάθειες επαλήθευσης. Παρακαλώ δοκιμάστε αργότερα.", "error")
                 return render_template("index.html", form={}, step="form")
-            else:
-                redis_helper.incr(otp_rate_key)
         
         # Step 2: Verify OTP and complete submission
         return handle_otp_verification()
@@ -433,14 +625,14 @@ def handle_form_submission():
             flash(e, "error")
         return render_template("index.html", form=request.form, step="form")
 
-    # Store form data in session for later use
-    session['form_data'] = {
+    # Store form data for later use (Redis-backed, only its ID in the session)
+    save_form_data({
         'first_name': first_name,
         'last_name': last_name,
         'phone': phone,
         'email': email,
         'comments': comments
-    }
+    })
 
     # Generate and send OTP
     otp = generate_otp()
@@ -472,14 +664,14 @@ def handle_otp_verification():
         flash(f"Σφάλμα επαλήθευσης: {message}", "error")
         if "expired" in message.lower() or "too many" in message.lower():
             # OTP expired or too many attempts, redirect to form
-            session.pop('form_data', None)  # Clear form data
+            clear_form_data()
             return render_template("index.html", form={}, step="form")
         else:
             # Invalid OTP, stay on OTP page
             return render_template("index.html", form={}, step="otp", email=email)
     
     # OTP verified, now process the original form submission
-    form_data = session.get('form_data')
+    form_data = load_form_data()
     if not form_data:
         flash("Τα δεδομένα της φόρμας έχουν λήξει. Παρακαλώ υποβάλετε ξανά.", "error")
         return redirect(url_for("index"))
@@ -487,6 +679,36 @@ def handle_otp_verification():
     # Process the submission with stored form data
     return process_verified_submission(form_data)
 
+# Parsed once at import; filled per submission with Template.substitute
+SUBMISSION_EMAIL_TEMPLATE = Template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+</head>
+<body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; line-height: 1.5; max-width: 560px; margin: 0 auto; padding: 20px; color: #333;">
+    <h2 style="color: #444; border-bottom: 1px solid #ddd; padding-bottom: 10px;">Νεο αιτημα επικοινωνίας</h2>
+    
+    <table style="width: 100%; border-spacing: 0; margin-bottom: 20px;">
+        <tr><td style="padding: 8px 0;"><strong>Ονομα (First name):</strong> ${first_name}</td></tr>
+        <tr><td style="padding: 8px 0;"><strong>Επώνυμο (Last name):</strong> ${last_name}</td></tr>
+        <tr><td style="padding: 8px 0;"><strong>Τηλ. (Phone):</strong> ${phone}</td></tr>
+        <tr><td style="padding: 8px 0;"><strong>Email:</strong> <a href="mailto:${email}" style="color: #2b5797;">${email}</a></td></tr>
+    </table>
+
+    <div style="border: 1px solid currentColor; border-radius: 4px; padding: 15px; margin: 20px 0;">
+        <div style="white-space: pre-wrap;">${comments}</div>
+    </div>
+
+    <div style="color: #666; font-size: 0.9em; margin-top: 20px;">
+        Reference ID: #${submission_id}<br>
+        <em>Email verified via OTP</em><br>
+        <em>Storage: ${storage}</em>
+    </div>
+</body>
+</html>
+""")
+
 def process_verified_submission(form_data):
     """Process the submission after OTP verification"""
     first_name = form_data['first_name']
@@ -496,7 +718,7 @@ def process_verified_submission(form_data):
     comments = form_data['comments']
 
     # Generate submission ID and track the submission
-    submission_id, tracking_data = get_next_submission_id()
+    submission_id = get_next_submission_id()
     
     # Prepare submission data for MongoDB
     submission_data = {
@@ -519,49 +741,31 @@ def process_verified_submission(form_data):
         else:
             print(f"Failed to save submission {submission_id} to MongoDB, using JSON fallback")
     
-    # Fallback to JSON file if MongoDB not available or failed
+    # Fallback to JSON log if MongoDB not available or failed
     if not mongo_saved:
-        tracking_data[submission_id] = {
+        record = {
+            "submission_id": submission_id,
             "email": email,
             "name": f"{first_name} {last_name}",
             "date": datetime.now().isoformat()
         }
         try:
-            with open(TRACKING_FILE, 'w') as f:
-                json.dump(tracking_data, f, indent=2)
-            print(f"Submission {submission_id} saved to JSON file")
+            with open(SUBMISSIONS_LOG_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            print(f"Submission {submission_id} saved to JSON log")
         except Exception as e:
             print(f"Error saving tracking data: {e}")
     
     # Compose email body with minimal HTML
-    body = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-</head>
-<body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; line-height: 1.5; max-width: 560px; margin: 0 auto; padding: 20px; color: #333;">
-    <h2 style="color: #444; border-bottom: 1px solid #ddd; padding-bottom: 10px;">Νεο αιτημα επικοινωνίας</h2>
-    
-    <table style="width: 100%; border-spacing: 0; margin-bottom: 20px;">
-        <tr><td style="padding: 8px 0;"><strong>Ονομα (First name):</strong> {first_name}</td></tr>
-        <tr><td style="padding: 8px 0;"><strong>Επώνυμο (Last name):</strong> {last_name}</td></tr>
-        <tr><td style="padding: 8px 0;"><strong>Τηλ. (Phone):</strong> {phone}</td></tr>
-        <tr><td style="padding: 8px 0;"><strong>Email:</strong> <a href="mailto:{email}" style="color: #2b5797;">{email}</a></td></tr>
-    </table>
-
-    <div style="border: 1px solid currentColor; border-radius: 4px; padding: 15px; margin: 20px 0;">
-        <div style="white-space: pre-wrap;">{comments}</div>
-    </div>
-
-    <div style="color: #666; font-size: 0.9em; margin-top: 20px;">
-        Reference ID: #{submission_id}<br>
-        <em>Email verified via OTP</em><br>
-        <em>Storage: {'MongoDB' if mongo_saved else 'JSON File'}</em>
-    </div>
-</body>
-</html>
-"""
+    body = SUBMISSION_EMAIL_TEMPLATE.substitute(
+        first_name=first_name,
+        last_name=last_name,
+        phone=phone,
+        email=email,
+        comments=comments,
+        submission_id=submission_id,
+        storage='MongoDB' if mongo_saved else 'JSON File'
+    )
 
     subject = f"Νεο αιτημα επικοινωνίας #{submission_id} — {first_name} {last_name}"
         
@@ -569,20 +773,19 @@ def process_verified_submission(form_data):
     body = f"Submission ID: #{submission_id}\n\n" + body
     
     try:
-        send_email(subject, body)
+        # Sent synchronously so a delivery failure triggers the fallback below
+        send_email_direct(subject, body)
         track_metric('form_submission_success')
         flash(f"Η φόρμα υποβλήθηκε επιτυχώς. Αριθμός αναφοράς: #{submission_id}", "success")
         # Clear form data from session
-        session.pop('form_data', None)
+        clear_form_data()
     except Exception as e:
         track_metric('form_submission_failed')
         # On failure, show helpful message (do not leak credentials)
         flash(f"Σφάλμα αποστολής email: {e}", "error")
         # Optionally write to local file as fallback:
         try:
-            fallback_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "submissions")
-            os.makedirs(fallback_dir, exist_ok=True)
-            fname = os.path.join(fallback_dir, f"comments_{first_name}_{last_name}.txt")
+            fname = os.path.join(FALLBACK_DIR, f"comments_{first_name}_{last_name}.txt")
             with open(fname, "w", encoding="utf-8") as f:
                 f.write(body)
             flash("Η δήλωση αποθηκεύτηκε τοπικά ως fallback.", "info")
@@ -603,32 +806,25 @@ def resend_otp():
         return redirect(url_for("index"))
     
     # Check if form data exists in session
-    form_data = session.get('form_data')
+    form_data = load_form_data()
     if not form_data or form_data.get('email') != email:
         flash("Τα δεδομένα της φόρμας έχουν λήξει. Παρακαλώ υποβάλετε ξανά.", "error")
         return redirect(url_for("index"))
     
     # Check cooldown period (30 seconds) using Redis or fallback
-    current_time = datetime.now()
-    
     if redis_helper.is_available():
+        # SET NX EX starts the cooldown, or fails if one is already running
         cooldown_key = f"otp_resend:{email}"
-        last_resend = redis_helper.get(cooldown_key)
-        if last_resend:
-            last_time = datetime.fromisoformat(str(last_resend))
-            time_diff = (current_time - last_time).total_seconds()
-            if time_diff < 30:
-                remaining_time = int(30 - time_diff)
-                flash(f"Παρακαλώ περιμένετε {remaining_time} δευτερόλεπτα πριν ζητήσετε νέο κωδικό.", "error")
-                return render_template("index.html", form=form_data, step="otp", email=email)
-        
-        # Update cooldown tracker in Redis
-        redis_helper.set(cooldown_key, current_time.isoformat(), ex=30)
+        if not redis_helper.set(cooldown_key, "1", ex=30, nx=True):
+            remaining_time = max(redis_helper.ttl(cooldown_key), 1)
+            flash(f"Παρακαλώ περιμένετε {remaining_time} δευτερόλεπτα πριν ζητήσετε νέο κωδικό.", "error")
+            return render_template("index.html", form=form_data, step="otp", email=email)
     else:
         # Fallback to in-memory cooldown
+        current_time = time.monotonic()
         if email in otp_resend_cooldown:
             last_resend = otp_resend_cooldown[email]
-            time_diff = (current_time - last_resend).total_seconds()
+            time_diff = current_time - last_resend
             if time_diff < 30:
                 remaining_time = int(30 - time_diff)
                 flash(f"Παρακαλώ περιμένετε {remaining_time} δευτερόλεπτα πριν ζητήσετε νέο κωδικό.", "error")
@@ -667,21 +863,17 @@ def check_submission(submission_id):
                     "storage": "mongodb"
                 })
         
-        # Fallback to JSON file
-        if os.path.exists(TRACKING_FILE):
-            with open(TRACKING_FILE, 'r') as f:
-                tracking_data = json.load(f)
-            
-            submission = tracking_data.get(submission_id)
-            if submission:
-                return jsonify({
-                    "id": submission_id,
-                    "status": "found",
-                    "submitted_at": submission["date"],
-                    "email": submission["email"],
-                    "name": submission.get("name", ""),
-                    "storage": "json"
-                })
+        # Fallback to JSON log
+        submission = find_logged_submission(submission_id)
+        if submission:
+            return jsonify({
+                "id": submission_id,
+                "status": "found",
+                "submitted_at": submission["date"],
+                "email": submission["email"],
+                "name": submission.get("name", ""),
+                "storage": "json"
+            })
         
         return jsonify({"status": "not_found"}), 404
     except Exception as e:
@@ -695,28 +887,24 @@ def view_submissions():
         submissions = []
         storage_type = "Unknown"
         
-        # Get submissions from MongoDB if available
+        # Get submissions from MongoDB if available (?before=<cursor> pages back)
         if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available():
-            submissions = mongo_helper.get_recent_submissions(50)
+            submissions = mongo_helper.get_recent_submissions(50, request.args.get("before"))
             storage_type = "MongoDB"
         else:
             # Fallback to JSON file
             storage_type = "JSON File"
-            if os.path.exists(TRACKING_FILE):
-                with open(TRACKING_FILE, 'r') as f:
-                    tracking_data = json.load(f)
-                
-                submissions = [
-                    {
-                        "submission_id": sub_id,
-                        "email": data.get("email", ""),
-                        "name": data.get("name", ""),
-                        "created_at": data.get("date", ""),
-                        "status": "submitted"
-                    }
-                    for sub_id, data in tracking_data.items()
-                ]
-                submissions.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+            # The log is append-only, so its tail holds the newest submissions
+            submissions = [
+                {
+                    "submission_id": data.get("submission_id", ""),
+                    "email": data.get("email", ""),
+                    "name": data.get("name", ""),
+                    "created_at": data.get("date", ""),
+                    "status": "submitted"
+                }
+                for data in read_recent_logged_submissions(50)
+            ]
         
         return jsonify({
             "submissions": submissions,
@@ -727,6 +915,26 @@ def view_submissions():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def ojsonify(data, status=200):
+    """jsonify() for the monitoring endpoints, serialized with orjson when installed"""
+    if orjson is None:
+        response = jsonify(data)
+        response.status_code = status
+        return response
+    return app.response_class(orjson.dumps(data), status=status, mimetype='application/json')
+
+# Submission counts are cached briefly so frequent scrapes don't hit MongoDB
+@cache_result("mongo:count_submissions", expiration=15)
+def count_all_submissions():
+    return mongo_helper.count_submissions()
+
+@cache_result("mongo:count_today", expiration=30)
+def count_submissions_on(day):
+    """Count submissions created since midnight UTC of day (YYYY-MM-DD)"""
+    return mongo_helper.count_submissions({"created_at": {"$gte": datetime.strptime(day, '%Y-%m-%d')}})
+
+CONNECTION_STATUS = {True: "connected", False: "disconnected"}
+
 @app.route("/metrics")
 @require_admin_auth
 def metrics():
@@ -735,36 +943,32 @@ def metrics():
         return jsonify({"error": "Metrics require Redis"}), 503
     
     try:
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        current_hour = datetime.now().strftime('%Y-%m-%d:%H')
+        mongo_ok = bool(MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available())
+        current_date, current_hour = g.metric_periods
+        
+        # Each period's counters live in one hash, fetched with a single HGETALL
+        counters = {
+            "form_submissions": "form_submission_success",
+            "otp_generated": "otp_generated",
+            "otp_verified": "otp_verified_success",
+            "otp_failed": "otp_verification_failed",
+        }
+        today = redis_helper.hgetall(f"metrics:{current_date}")
+        hourly = redis_helper.hgetall(f"metrics:{current_hour}")
         
         metrics_data = {
-            "today": {
-                "form_submissions": redis_helper.get(f"metrics:form_submission_success:{current_date}", "0"),
-                "otp_generated": redis_helper.get(f"metrics:otp_generated:{current_date}", "0"),
-                "otp_verified": redis_helper.get(f"metrics:otp_verified_success:{current_date}", "0"),
-                "otp_failed": redis_helper.get(f"metrics:otp_verification_failed:{current_date}", "0"),
-            },
-            "current_hour": {
-                "form_submissions": redis_helper.get(f"metrics:form_submission_success:{current_hour}", "0"),
-                "otp_generated": redis_helper.get(f"metrics:otp_generated:{current_hour}", "0"),
-                "otp_verified": redis_helper.get(f"metrics:otp_verified_success:{current_hour}", "0"),
-                "otp_failed": redis_helper.get(f"metrics:otp_verification_failed:{current_hour}", "0"),
-            },
-            "redis_status": "connected",
-            "mongodb_status": "connected" if (MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available()) else "disconnected",
-            "timestamp": datetime.now().isoformat()
+            "today": {label: today.get(metric, "0") for label, metric in counters.items()},
+            "current_hour": {label: hourly.get(metric, "0") for label, metric in counters.items()},
+            "redis_status": CONNECTION_STATUS[True],
+            "mongodb_status": CONNECTION_STATUS[mongo_ok],
+            "timestamp": datetime.now().isoformat(timespec='seconds')
         }
         
         # Add MongoDB submission counts if available
-        if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available():
+        if mongo_ok:
             try:
-                total_submissions = mongo_helper.count_submissions()
-                today_submissions = mongo_helper.count_submissions({
-                    "created_at": {
-                        "$gte": datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-                    }
-                })
+                total_submissions = count_all_submissions()
+                today_submissions = count_submissions_on(datetime.utcnow().strftime('%Y-%m-%d'))
                 metrics_data["mongodb"] = {
                     "total_submissions": total_submissions,
                     "today_submissions": today_submissions,
@@ -780,25 +984,38 @@ def metrics():
                 "status": "unavailable"
             }
         
-        return jsonify(metrics_data)
+        return ojsonify(metrics_data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Backend probes run on their own small pools so a slow backend can't stall the liveness
+# check or starve the other probe; the pings themselves give up after about 1s
+HEALTH_CHECK_TIMEOUT = 2.0  # seconds
+REDIS_PROBE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="redis-probe")
+MONGO_PROBE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mongo-probe")
+
 @app.route("/health")
 def health_check():
     """Health check endpoint for production monitoring"""
     health_status = {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
         "services": {}
     }
     
     overall_healthy = True
     
+    # Start both backend probes in parallel; each wait is bounded below
+    redis_probe = mongo_probe = None
+    if redis_helper.is_available() and redis_helper.probe_client:
+        redis_probe = REDIS_PROBE_EXECUTOR.submit(redis_helper.probe_client.ping)
+    if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available():
+        mongo_probe = MONGO_PROBE_EXECUTOR.submit(mongo_helper.ping)
+    
     # Check Redis connection
     try:
-        if redis_helper.is_available() and redis_helper.redis_client:
-            redis_helper.redis_client.ping()
+        if redis_probe:
+            redis_probe.result(timeout=HEALTH_CHECK_TIMEOUT)
             health_status["services"]["redis"] = {
                 "status": "healthy",
                 "sessions": "enabled",
@@ -807,6 +1024,12 @@ def health_check():
         else:
             health_status["services"]["redis"] = {"status": "unavailable"}
             overall_healthy = False
+    except FuturesTimeoutError:
+        health_status["services"]["redis"] = {
+            "status": "unhealthy",
+            "error": f"ping timed out after {HEALTH_CHECK_TIMEOUT}s"
+        }
+        overall_healthy = False
     except Exception as e:
         health_status["services"]["redis"] = {
             "status": "unhealthy", 
@@ -816,16 +1039,25 @@ def health_check():
     
     # Check MongoDB connection
     try:
-        if MONGO_AVAILABLE and mongo_helper and mongo_helper.is_available():
-            # Try a simple operation
-            mongo_helper.count_submissions()
-            health_status["services"]["mongodb"] = {
-                "status": "healthy",
-                "storage": "enabled"
-            }
+        if mongo_probe:
+            if mongo_probe.result(timeout=HEALTH_CHECK_TIMEOUT):
+                health_status["services"]["mongodb"] = {
+                    "status": "healthy",
+                    "storage": "enabled"
+                }
+            else:
+                health_status["services"]["mongodb"] = {
+                    "status": "unhealthy",
+                    "error": "ping failed"
+                }
         else:
             health_status["services"]["mongodb"] = {"status": "unavailable"}
             # MongoDB unavailable is not critical (we have JSON fallback)
+    except FuturesTimeoutError:
+        health_status["services"]["mongodb"] = {
+            "status": "unhealthy",
+            "error": f"probe timed out after {HEALTH_CHECK_TIMEOUT}s"
+        }
     except Exception as e:
         health_status["services"]["mongodb"] = {
             "status": "unhealthy", 
@@ -857,7 +1089,7 @@ def health_check():
     
     # Return appropriate HTTP status code
     status_code = 200 if overall_healthy else 503
-    return jsonify(health_status), status_code
+    return ojsonify(health_status, status_code)
 
 @app.route("/admin/logout")
 @require_admin_auth 
@@ -898,13 +1130,14 @@ def admin_password_info():
 @require_admin_auth
 def admin_regenerate_hash():
     """Regenerate admin password hash from current environment password"""
-    global CURRENT_ADMIN_HASH
+    global CURRENT_ADMIN_HASH, CURRENT_ADMIN_HASH_BYTES
     
     if not ADMIN_PASSWORD:
         return jsonify({"error": "No ADMIN_PASSWORD set in environment"}), 400
     
-    # Generate new hash
-    new_hash = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Generate new hash; the verify path uses the bytes, storage uses the str
+    CURRENT_ADMIN_HASH_BYTES = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_COST))
+    new_hash = CURRENT_ADMIN_HASH_BYTES.decode('utf-8')
     
     # Update stored hash
     CURRENT_ADMIN_HASH = new_hash
@@ -3,11 +3,19 @@
 Virtual Environment and Python Update Checker
 """
 import sys
-import pkg_resources
 import subprocess
 import json
+import re
+from importlib.metadata import distributions
 from pathlib import Path
 
+# "name==version" lines; comments and unpinned entries don't match
+REQUIREMENT_RE = re.compile(r"([\w\-.]+)==([\w\-.]+)")
+
+def normalize_name(name):
+    """PEP 503 name normalization (Flask_Session -> flask-session)"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
 def check_python_version():
     """Check current Python version"""
     print(f"🐍 Current Python: {sys.version}")
@@ -38,31 +46,30 @@ def check_dependencies():
         
         print("\n📦 Checking dependencies from requirements.txt:")
         
+        # Parse pinned requirements once: {normalized_name: required_version}
         with open(requirements_file, 'r') as f:
-            requirements = [line.strip() for line in f.readlines() 
-                          if line.strip() and not line.startswith('#')]
+            requirements = {
+                normalize_name(m.group(1)): m.group(2)
+                for m in (REQUIREMENT_RE.match(line.strip()) for line in f)
+                if m
+            }
         
-        installed_packages = {pkg.project_name.lower(): pkg.version 
-                            for pkg in pkg_resources.working_set}
+        installed_packages = {normalize_name(dist.metadata['Name']): dist.version
+                              for dist in distributions() if dist.metadata['Name']}
         
-        missing = []
-        outdated = []
+        missing = [f"{name}=={version}" for name, version in requirements.items()
+                   if name not in installed_packages]
+        outdated = [f"{name}=={version}" for name, version in requirements.items()
+                    if name in installed_packages and installed_packages[name] != version]
         
-        for req in requirements:
-            if '==' in req:
-                package_name, required_version = req.split('==')
-                package_name = package_name.lower()
-                
-                if package_name in installed_packages:
-                    installed_version = installed_packages[package_name]
-                    if installed_version == required_version:
-                        print(f"  ✅ {package_name}: {installed_version}")
-                    else:
-                        print(f"  ⚠️  {package_name}: {installed_version} (required: {required_version})")
-                        outdated.append(f"{package_name}=={required_version}")
-                else:
-                    print(f"  ❌ {package_name}: NOT INSTALLED")
-                    missing.append(req)
+        for name, version in requirements.items():
+            installed_version = installed_packages.get(name)
+            if installed_version is None:
+                print(f"  ❌ {name}: NOT INSTALLED")
+            elif installed_version == version:
+                print(f"  ✅ {name}: {installed_version}")
+            else:
+                print(f"  ⚠️  {name}: {installed_version} (required: {version})")
         
         if missing:
             print(f"\n❌ Missing packages: {len(missing)}")
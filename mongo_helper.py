@@ -1,9 +1,12 @@
 # mongo_helper.py
 import os
 import json
+import threading
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any, List
-from pymongo import MongoClient
+from typing import Optional, Dict, Any, Iterator, List
+from bson import ObjectId
+from pymongo import MongoClient, WriteConcern, timeout as operation_timeout
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 
 class MongoHelper:
@@ -12,6 +15,11 @@ class MongoHelper:
         self.client: Optional[MongoClient] = None
         self.db = None
         self.mongo_available = False
+        # Metrics are buffered and written in batches (see save_metric)
+        self._metric_buffer: List[Dict[str, Any]] = []
+        self._metric_buffer_started = time.monotonic()
+        self._metric_lock = threading.Lock()
+        self._metric_flusher: Optional[threading.Thread] = None
         self._connect()
     
     def _connect(self):
@@ -33,8 +41,9 @@ class MongoHelper:
             self.mongo_available = True
             print("MongoDB connected successfully")
             
-            # Create indexes for better performance
-            self._create_indexes()
+            # Create indexes off the startup path; the server blocks each
+            # create_index call until its build finishes
+            threading.Thread(target=self._create_indexes, name="mongo-index-builder", daemon=True).start()
             
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
             print(f"MongoDB connection failed: {e}. Falling back to JSON file storage.")
@@ -52,14 +61,17 @@ class MongoHelper:
             # Submissions collection indexes
             submissions = self.db.submissions
             submissions.create_index("submission_id", unique=True)
-            submissions.create_index("email")
+            # Not partial: daily counts include migrated submissions too
             submissions.create_index("created_at")
+            # Also serves email-only lookups via its prefix
             submissions.create_index([("email", 1), ("created_at", -1)])
             
             # Metrics collection indexes
             metrics = self.db.metrics
             metrics.create_index([("metric_name", 1), ("timestamp", -1)])
             metrics.create_index("date")
+            # Expire raw metric events after 30 days
+            metrics.create_index("timestamp", expireAfterSeconds=86400 * 30)
             
             print("MongoDB indexes created successfully")
         except Exception as e:
@@ -67,7 +79,21 @@ class MongoHelper:
     
     def is_available(self) -> bool:
         """Check if MongoDB is available"""
-        return self.mongo_available and self.client is not None and self.db is not None
+        # _connect only sets mongo_available once client and db are in place
+        return self.mongo_available
+    
+    def ping(self, timeout: float = 1.0) -> bool:
+        """Lightweight liveness check (no collection access), bounded client-side by timeout seconds"""
+        if not self.is_available():
+            return False
+        
+        try:
+            with operation_timeout(timeout):
+                self.client.admin.command('ping')
+            return True
+        except Exception as e:
+            print(f"MongoDB ping failed: {e}")
+            return False
     
     def save_submission(self, submission_data: Dict[str, Any]) -> bool:
         """Save form submission to MongoDB"""
@@ -104,21 +130,22 @@ class MongoHelper:
             print(f"Error fetching submission from MongoDB: {e}")
             return None
     
-    def get_submissions_by_email(self, email: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get submissions by email address"""
+    def iter_submissions_by_email(self, email: str, limit: int = 10) -> Iterator[Dict[str, Any]]:
+        """Yield submissions by email address as the cursor streams them"""
         if not self.is_available():
-            return []
+            return
         
         try:
-            cursor = self.db.submissions.find(
+            yield from self.db.submissions.find(
                 {"email": email},
                 {"_id": 0}  # Exclude MongoDB ObjectId
             ).sort("created_at", -1).limit(limit)
-            
-            return list(cursor)
         except Exception as e:
             print(f"Error fetching submissions by email from MongoDB: {e}")
-            return []
+    
+    def get_submissions_by_email(self, email: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get submissions by email address"""
+        return list(self.iter_submissions_by_email(email, limit))
     
     def count_submissions(self, filters: Optional[Dict[str, Any]] = None) -> int:
         """Count submissions with optional filters"""
@@ -127,49 +154,96 @@ class MongoHelper:
         
         try:
             if filters:
+                # Date-range counts (the only filtered caller) ride the created_at index
+                if set(filters) == {"created_at"}:
+                    return self.db.submissions.count_documents(filters, hint=[("created_at", 1)])
                 return self.db.submissions.count_documents(filters)
             else:
-                return self.db.submissions.count_documents({})
+                # O(1) read from collection metadata instead of a full count
+                return self.db.submissions.estimated_document_count()
         except Exception as e:
             print(f"Error counting submissions in MongoDB: {e}")
             return 0
     
-    def get_recent_submissions(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get recent submissions"""
+    def get_recent_submissions(self, limit: int = 50, before_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get recent submissions, newest first, optionally older than a previous cursor"""
         if not self.is_available():
             return []
         
         try:
+            query: Dict[str, Any] = {}
+            if before_id:
+                if not ObjectId.is_valid(before_id):
+                    return []
+                query["_id"] = {"$lt": ObjectId(before_id)}
+            
+            # _id order follows insertion time and needs no extra index or skip()
             cursor = self.db.submissions.find(
-                {},
-                {"_id": 0, "comments": 0}  # Exclude ObjectId and comments for privacy
-            ).sort("created_at", -1).limit(limit)
+                query,
+                # Only the fields the admin listing shows (never comments); _id feeds the cursor
+                {"submission_id": 1, "email": 1, "name": 1, "created_at": 1, "status": 1}
+            ).sort("_id", -1).limit(limit)
             
-            return list(cursor)
+            submissions = []
+            for submission in cursor:
+                submission["cursor"] = str(submission.pop("_id"))
+                submissions.append(submission)
+            return submissions
         except Exception as e:
             print(f"Error fetching recent submissions from MongoDB: {e}")
             return []
     
     def save_metric(self, metric_name: str, value: int = 1, metadata: Optional[Dict] = None) -> bool:
-        """Save metric to MongoDB"""
+        """Buffer a metric for MongoDB; flushed every 100 metrics or 5 seconds"""
         if not self.is_available():
             return False
         
+        now = datetime.utcnow()
+        metric_data = {
+            'metric_name': metric_name,
+            'value': value,
+            'timestamp': now,
+            'date': now.strftime('%Y-%m-%d'),
+            'hour': now.strftime('%Y-%m-%d:%H'),
+            'metadata': metadata or {}
+        }
+        
+        with self._metric_lock:
+            if not self._metric_buffer:
+                self._metric_buffer_started = time.monotonic()
+            self._metric_buffer.append(metric_data)
+            if self._metric_flusher is None:
+                self._metric_flusher = threading.Thread(target=self._flush_metrics_periodically, name="mongo-metric-flusher", daemon=True)
+                self._metric_flusher.start()
+            full = len(self._metric_buffer) >= 100
+        
+        if full:
+            self.flush_metrics()
+        return True
+    
+    def flush_metrics(self) -> int:
+        """Write buffered metrics with one unacknowledged insert_many"""
+        with self._metric_lock:
+            batch, self._metric_buffer = self._metric_buffer, []
+        if not batch or not self.is_available():
+            return 0
+        
         try:
-            metric_data = {
-                'metric_name': metric_name,
-                'value': value,
-                'timestamp': datetime.utcnow(),
-                'date': datetime.utcnow().strftime('%Y-%m-%d'),
-                'hour': datetime.utcnow().strftime('%Y-%m-%d:%H'),
-                'metadata': metadata or {}
-            }
-            
-            result = self.db.metrics.insert_one(metric_data)
-            return result.acknowledged
+            # w=0: fire-and-forget, metrics tolerate occasional loss
+            self.db.metrics.with_options(write_concern=WriteConcern(w=0)).insert_many(batch, ordered=False)
+            return len(batch)
         except Exception as e:
-            print(f"Error saving metric to MongoDB: {e}")
-            return False
+            print(f"Error saving metrics to MongoDB: {e}")
+            return 0
+    
+    def _flush_metrics_periodically(self):
+        """Flush buffered metrics once they are 5 seconds old"""
+        while True:
+            time.sleep(1)
+            with self._metric_lock:
+                due = self._metric_buffer and time.monotonic() - self._metric_buffer_started >= 5
+            if due:
+                self.flush_metrics()
     
     def get_metrics_summary(self, date: Optional[str] = None) -> Dict[str, Any]:
         """Get metrics summary for a specific date or today"""
@@ -205,6 +279,7 @@ class MongoHelper:
     
     def close(self):
         """Close MongoDB connection"""
+        self.flush_metrics()
         if self.client:
             self.client.close()
             self.mongo_available = False
@@ -219,18 +294,28 @@ def migrate_json_to_mongo():
         return False
     
     import json
-    tracking_file = "submissions_tracking.json"
+    log_file = "submissions.jsonl"
+    tracking_file = "submissions_tracking.json"  # Legacy format
     
-    if not os.path.exists(tracking_file):
+    if not os.path.exists(log_file) and not os.path.exists(tracking_file):
         print("No existing submissions to migrate")
         return True
     
+    def iter_json_submissions():
+        """Yield (submission_id, data) pairs, streaming the JSONL log line by line"""
+        if os.path.exists(log_file):
+            with open(log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        yield record.pop('submission_id'), record
+        else:
+            with open(tracking_file, 'r') as f:
+                yield from json.load(f).items()
+    
     try:
-        with open(tracking_file, 'r') as f:
-            tracking_data = json.load(f)
-        
         migrated_count = 0
-        for submission_id, data in tracking_data.items():
+        for submission_id, data in iter_json_submissions():
             # Check if already exists
             existing = mongo_helper.get_submission(submission_id)
             if existing:
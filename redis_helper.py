@@ -5,19 +5,42 @@ import redis
 from datetime import datetime, timedelta
 from functools import wraps
 import hashlib
+import queue
+import threading
+from collections import Counter
+from flask import abort, g, has_request_context
 from typing import Optional, Any, Union
 
+PROBE_TIMEOUT = 1  # Seconds; read timeout for health-check pings
+
 class RedisHelper:
     def __init__(self):
         self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
         self.redis_client: Optional[redis.Redis] = None
+        self.probe_client: Optional[redis.Redis] = None
         self.redis_available = False
         self._connect()
     
     def _connect(self):
         """Initialize Redis connection with fallback"""
         try:
-            self.redis_client = redis.from_url(self.redis_url, decode_responses=True)
+            pool = redis.ConnectionPool.from_url(
+                self.redis_url,
+                max_connections=32,
+                health_check_interval=30,  # PING connections idle for 30s+ before reuse
+                socket_connect_timeout=2,  # Fail fast on an unreachable server
+                decode_responses=True
+            )
+            self.redis_client = redis.Redis(connection_pool=pool)
+            # The main pool has no read timeout (the email worker blocks in BLPOP),
+            # so health probes get a small pool of their own that gives up quickly
+            self.probe_client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+                self.redis_url,
+                max_connections=2,
+                socket_connect_timeout=PROBE_TIMEOUT,
+                socket_timeout=PROBE_TIMEOUT,
+                decode_responses=True
+            ))
             # Test connection
             if self.redis_client:
                 self.redis_client.ping()
@@ -41,12 +64,12 @@ class RedisHelper:
         except Exception:
             return default
     
-    def set(self, key: str, value: Union[str, int], ex: Optional[int] = None) -> bool:
-        """Set value in Redis with optional expiration"""
+    def set(self, key: str, value: Union[str, int], ex: Optional[int] = None, nx: bool = False) -> bool:
+        """Set value in Redis with optional expiration (nx=True only sets a missing key)"""
         if not self.is_available() or not self.redis_client:
             return False
         try:
-            result = self.redis_client.set(key, value, ex=ex)
+            result = self.redis_client.set(key, value, ex=ex, nx=nx)
             return bool(result)
         except Exception:
             return False
@@ -61,6 +84,15 @@ class RedisHelper:
         except Exception:
             return default
     
+    def hgetall(self, name: str) -> dict:
+        """Get all fields of a Redis hash"""
+        if not self.is_available() or not self.redis_client:
+            return {}
+        try:
+            return dict(self.redis_client.hgetall(name))
+        except Exception:
+            return {}
+    
     def hset(self, name: str, mapping: dict) -> bool:
         """Set hash fields in Redis"""
         if not self.is_available() or not self.redis_client:
@@ -71,6 +103,19 @@ class RedisHelper:
         except Exception:
             return False
     
+    def hset_with_expiry(self, name: str, mapping: dict, time: int) -> bool:
+        """Set hash fields and their expiration in one round-trip"""
+        if not self.is_available() or not self.redis_client:
+            return False
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hset(name, mapping=mapping)
+            pipe.expire(name, time)
+            pipe.execute()
+            return True
+        except Exception:
+            return False
+    
     def expire(self, name: str, time: int) -> bool:
         """Set expiration for Redis key"""
         if not self.is_available() or not self.redis_client:
@@ -91,6 +136,15 @@ class RedisHelper:
         except Exception:
             return False
     
+    def ttl(self, name: str) -> int:
+        """Get remaining time to live of a key in seconds (negative if missing or persistent)"""
+        if not self.is_available() or not self.redis_client:
+            return -2
+        try:
+            return int(self.redis_client.ttl(name))
+        except Exception:
+            return -2
+    
     def exists(self, name: str) -> bool:
         """Check if key exists in Redis"""
         if not self.is_available() or not self.redis_client:
@@ -111,6 +165,29 @@ class RedisHelper:
         except Exception:
             return None
     
+    def rpush(self, name: str, *values: str) -> bool:
+        """Append values to a Redis list"""
+        if not self.is_available() or not self.redis_client:
+            return False
+        try:
+            result = self.redis_client.rpush(name, *values)
+            return bool(result)
+        except Exception:
+            return False
+    
+    def incr_with_expiry(self, name: str, window: int, amount: int = 1) -> Optional[int]:
+        """Increment a counter and start its expiry window on first use, in one round-trip"""
+        if not self.is_available() or not self.redis_client:
+            return None
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.incr(name, amount)
+            pipe.expire(name, window, nx=True)
+            count, _ = pipe.execute()
+            return int(count)
+        except Exception:
+            return None
+    
     def hincrby(self, name: str, key: str, amount: int = 1) -> Optional[int]:
         """Increment hash field in Redis"""
         if not self.is_available() or not self.redis_client:
@@ -121,6 +198,24 @@ class RedisHelper:
         except Exception:
             return None
 
+    def register_script(self, script: str) -> Optional[Any]:
+        """Register a Lua script (loaded lazily by EVALSHA on first call)"""
+        if not self.is_available() or not self.redis_client:
+            return None
+        try:
+            return self.redis_client.register_script(script)
+        except Exception:
+            return None
+    
+    def run_script(self, script: Any, keys: list, args: list, default: Any = None) -> Any:
+        """Run a registered Lua script atomically on the server"""
+        if script is None or not self.is_available():
+            return default
+        try:
+            return script(keys=keys, args=args)
+        except Exception:
+            return default
+
 # Global Redis instance
 redis_helper = RedisHelper()
 
@@ -131,7 +226,7 @@ def cache_result(key_prefix, expiration=3600):
         def wrapper(*args, **kwargs):
             # Create cache key
             key_data = f"{key_prefix}:{str(args)}:{str(kwargs)}"
-            cache_key = hashlib.md5(key_data.encode()).hexdigest()
+            cache_key = hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
             
             # Try to get from cache
             cached_result = redis_helper.get(cache_key)
@@ -157,26 +252,83 @@ def rate_limit(key_prefix, limit=5, window=300):
             identifier = kwargs.get('identifier') or (args[0] if args else 'unknown')
             rate_key = f"rate_limit:{key_prefix}:{identifier}"
             
-            current = redis_helper.get(rate_key)
-            if current is None:
-                redis_helper.set(rate_key, 1, ex=window)
-                return func(*args, **kwargs)
-            elif int(str(current)) < limit:
-                redis_helper.incr(rate_key)
+            count = redis_helper.incr_with_expiry(rate_key, window)
+            if count is None or count <= limit:
                 return func(*args, **kwargs)
             else:
-                from flask import abort
                 abort(429)  # Too Many Requests
         return wrapper
     return decorator
 
+# Increment the metric's field in the hourly and daily hashes, setting each TTL
+# only when the hash is new (TTL == -1) instead of re-sending EXPIRE every event
+TRACK_METRIC_LUA = """
+redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('TTL', KEYS[1]) == -1 then redis.call('EXPIRE', KEYS[1], ARGV[3]) end
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('TTL', KEYS[2]) == -1 then redis.call('EXPIRE', KEYS[2], ARGV[4]) end
+return 1
+"""
+track_metric_script = redis_helper.register_script(TRACK_METRIC_LUA)
+
+# Metric events are queued and written by a background thread, off the request path
+METRIC_BATCH_SIZE = 256
+metric_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=10000)
+
+def flush_metrics(batch):
+    """Write a batch of queued metric events in one pipeline, merging duplicates"""
+    totals: Counter = Counter()
+    for hour_key, day_key, metric_name, value in batch:
+        totals[(hour_key, day_key, metric_name)] += value
+    
+    pipe = redis_helper.redis_client.pipeline(transaction=False)
+    for (hour_key, day_key, metric_name), value in totals.items():
+        # Keep hourly counters for 7 days, daily ones for 30 days
+        track_metric_script(
+            keys=[hour_key, day_key],
+            args=[metric_name, value, 86400 * 7, 86400 * 30],
+            client=pipe
+        )
+    pipe.execute()
+
+def metric_worker():
+    """Drain the metric queue in batches of up to METRIC_BATCH_SIZE events"""
+    while True:
+        batch = [metric_queue.get()]
+        while len(batch) < METRIC_BATCH_SIZE:
+            try:
+                batch.append(metric_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            flush_metrics(batch)
+        except Exception as e:
+            print(f"Error writing metrics to Redis: {e}")
+
+if redis_helper.is_available():
+    threading.Thread(target=metric_worker, name="metric-writer", daemon=True).start()
+
+def metric_periods(now: Optional[datetime] = None) -> tuple:
+    """Return the (day, hour) metric key suffixes, e.g. ('2024-11-14', '2024-11-14:10')"""
+    d = now or datetime.now()
+    # f-string formatting is cheaper than strftime for this fixed layout
+    day = f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
+    return day, f"{day}:{d.hour:02d}"
+
 def track_metric(metric_name, value=1):
-    """Track application metrics in Redis"""
-    hour_key = f"metrics:{metric_name}:{datetime.now().strftime('%Y-%m-%d:%H')}"
-    day_key = f"metrics:{metric_name}:{datetime.now().strftime('%Y-%m-%d')}"
+    """Track application metrics in Redis (queued, never blocks the caller)"""
+    if not redis_helper.is_available():
+        return
+    
+    # Reuse the periods computed once per request when available
+    periods = g.get('metric_periods') if has_request_context() else None
+    day, hour = periods or metric_periods()
     
-    redis_helper.incr(hour_key, value)
-    redis_helper.expire(hour_key, 86400 * 7)  # Keep for 7 days
+    # One hash per hour and per day holds all of that period's counters
+    hour_key = f"metrics:{hour}"
+    day_key = f"metrics:{day}"
     
-    redis_helper.incr(day_key, value)
-    redis_helper.expire(day_key, 86400 * 30)  # Keep for 30 days
+    try:
+        metric_queue.put_nowait((hour_key, day_key, metric_name, value))
+    except queue.Full:
+        pass  # Drop the event rather than stall a request
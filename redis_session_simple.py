@@ -5,8 +5,48 @@ This provides a straightforward way to re-enable Redis sessions
 
 import json
 from datetime import timedelta
+import redis
+from redis.utils import HIREDIS_AVAILABLE
 from flask_session import Session
 
+UNLINK_BATCH_SIZE = 500
+SESSION_KEY_PATTERNS = ("session:*", "l7form:*", "flask_session*")
+SESSION_LIFETIME = timedelta(hours=24)
+
+
+def unlink_keys(redis_client, keys, batch_size=UNLINK_BATCH_SIZE):
+    """
+    Remove keys with UNLINK in fixed-size chunks sent over one pipeline
+    
+    Args:
+        redis_client: Redis client instance
+        keys: Iterable of keys to remove, e.g. a scan_iter() cursor
+        batch_size: Keys per UNLINK command
+    
+    Returns:
+        int: Number of keys submitted for removal
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    batch = []
+    total = 0
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            pipe.unlink(*batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        pipe.unlink(*batch)
+        total += len(batch)
+    if total:
+        pipe.execute()
+    return total
+
+
+def scan_keys(redis_client, pattern, count=UNLINK_BATCH_SIZE):
+    """Iterate keys matching pattern with SCAN instead of a blocking KEYS"""
+    return redis_client.scan_iter(match=pattern, count=count)
+
 
 def setup_redis_sessions_simple(app, redis_client, clear_existing=True):
     """
@@ -25,28 +65,29 @@ def setup_redis_sessions_simple(app, redis_client, clear_existing=True):
         if clear_existing:
             try:
                 # Clear only session keys, not OTP/cache data
-                pattern = "session:*"
-                keys = redis_client.keys(pattern)
-                if keys:
-                    redis_client.delete(*keys)
-                    app.logger.info(f"Cleared {len(keys)} existing session keys")
-            except Exception as e:
-                app.logger.warning(f"Could not clear session keys: {e}")
+                cleared = unlink_keys(redis_client, scan_keys(redis_client, "session:*"))
+                if cleared:
+                    app.logger.info("Cleared %d existing session keys", cleared)
+            except redis.exceptions.RedisError as e:
+                app.logger.warning("Could not clear session keys: %s", e)
         
         # Create a separate Redis connection for sessions without decode_responses
         # This is the key fix - Flask-Session 0.8.0 needs binary Redis connection
-        import redis
-        redis_url = redis_client.connection_pool.connection_kwargs.get('host', 'localhost')
-        redis_port = redis_client.connection_pool.connection_kwargs.get('port', 6379)
-        redis_db = redis_client.connection_pool.connection_kwargs.get('db', 0)
+        source_pool = redis_client.connection_pool
+        # Clone the app client's settings so password, TLS and timeouts carry over
+        connection_kwargs = dict(source_pool.connection_kwargs)
+        connection_kwargs['decode_responses'] = False  # Critical: Flask-Session needs binary data
         
-        # Create session Redis client without decode_responses
-        session_redis = redis.Redis(
-            host=redis_url, 
-            port=redis_port, 
-            db=redis_db,
-            decode_responses=False  # Critical: Flask-Session needs binary data
+        # Create session Redis client on its own bounded pool; requests wait up to
+        # 5s for a free connection instead of opening unbounded ones
+        pool = redis.BlockingConnectionPool(
+            connection_class=source_pool.connection_class,
+            max_connections=app.config.get('SESSION_REDIS_POOL_SIZE', 32),
+            timeout=5,
+            **connection_kwargs
         )
+        session_redis = redis.Redis(connection_pool=pool)
+        app.extensions['session_redis_pool'] = pool
         
         # Test the session Redis connection
         session_redis.ping()
@@ -62,17 +103,20 @@ def setup_redis_sessions_simple(app, redis_client, clear_existing=True):
             'SESSION_COOKIE_HTTPONLY': True,
             'SESSION_COOKIE_SECURE': False,  # Set True for HTTPS
             'SESSION_COOKIE_SAMESITE': 'Lax',
-            'PERMANENT_SESSION_LIFETIME': timedelta(hours=24)
+            'PERMANENT_SESSION_LIFETIME': SESSION_LIFETIME
         })
         
         # Initialize Flask-Session
         Session(app)
         
         app.logger.info("✅ Redis sessions configured successfully with binary Redis client")
+        # redis-py parses replies in C automatically when hiredis is installed
+        if not HIREDIS_AVAILABLE:
+            app.logger.warning("hiredis not installed; Redis replies use the pure-Python parser")
         return True
         
-    except Exception as e:
-        app.logger.error(f"❌ Failed to setup Redis sessions: {e}")
+    except redis.exceptions.RedisError as e:
+        app.logger.error("❌ Failed to setup Redis sessions: %s", e)
         return False
 
 
@@ -94,15 +138,12 @@ def test_redis_sessions_simple(app, redis_client):
                 sess['test_key'] = 'test_value'
                 sess['user_id'] = 12345
             
-            # Verify session was saved to Redis
-            pattern = "session:*"
-            keys = redis_client.keys(pattern)
-            
-            if not keys:
+            # Verify session was saved to Redis; one key is enough
+            if next(scan_keys(redis_client, "session:*", count=10), None) is None:
                 app.logger.error("❌ No session keys found in Redis")
                 return False
             
-            app.logger.info(f"✅ Found {len(keys)} session keys in Redis")
+            app.logger.info("✅ Found session keys in Redis")
             
             # Test session retrieval in a new request
             with client.session_transaction() as sess:
@@ -117,7 +158,7 @@ def test_redis_sessions_simple(app, redis_client):
                     return False
             
     except Exception as e:
-        app.logger.error(f"❌ Redis session test failed: {e}")
+        app.logger.error("❌ Redis session test failed: %s", e)
         return False
 
 
@@ -133,19 +174,17 @@ def clear_corrupted_sessions(redis_client):
     """
     try:
         # Clear all session keys
-        patterns = ["session:*", "l7form:*", "flask_session*"]
         total_cleared = 0
         
-        for pattern in patterns:
-            keys = redis_client.keys(pattern)
-            if keys:
-                redis_client.delete(*keys)
-                total_cleared += len(keys)
-                print(f"Cleared {len(keys)} keys matching pattern: {pattern}")
+        for pattern in SESSION_KEY_PATTERNS:
+            cleared = unlink_keys(redis_client, scan_keys(redis_client, pattern))
+            if cleared:
+                total_cleared += cleared
+                print(f"Cleared {cleared} keys matching pattern: {pattern}")
         
         return total_cleared
         
-    except Exception as e:
+    except redis.exceptions.RedisError as e:
         print(f"Error clearing sessions: {e}")
         return 0
 
@@ -165,13 +204,16 @@ def validate_redis_connection(redis_client):
         test_key = "test:connection"
         test_value = json.dumps({"test": "data", "timestamp": "2024-01-01"})
         
-        # Set and get test data
-        redis_client.setex(test_key, 60, test_value)
-        retrieved = redis_client.get(test_key)
+        # Set, read back and remove the test data in one round-trip
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.setex(test_key, 60, test_value)
+        pipe.get(test_key)
+        pipe.delete(test_key)
+        _, retrieved, _ = pipe.execute()
         
         if retrieved:
-            data = json.loads(retrieved.decode('utf-8'))
-            redis_client.delete(test_key)
+            # json.loads takes the raw bytes from the binary client directly
+            data = json.loads(retrieved)
             
             if data.get('test') == 'data':
                 print("✅ Redis connection and JSON serialization working")
@@ -180,15 +222,13 @@ def validate_redis_connection(redis_client):
         print("❌ Redis validation failed")
         return False
         
-    except Exception as e:
+    except (redis.exceptions.RedisError, ValueError) as e:
         print(f"❌ Redis validation error: {e}")
         return False
 
 
 if __name__ == "__main__":
     # This can be run standalone to test Redis connection
-    import redis
-    
     try:
         r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=False)
         print("Testing Redis connection...")
@@ -0,0 +1,113 @@
+# smtp_pool.py
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+class SMTPPool:
+    """Pool of logged-in SMTP connections so TLS + AUTH is paid once, not per email"""
+
+    def __init__(self, host: str, port: int, user: Optional[str], password: Optional[str],
+                 max_size: int = 4, max_idle: int = 300, timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.max_size = max_size
+        self.max_idle = max_idle  # Seconds before an unused connection is closed
+        self.timeout = timeout
+        self._available: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open a new connection and log in"""
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.port in (587, 25):
+                smtp.starttls()
+                smtp.ehlo()
+            smtp.login(self.user, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        return smtp
+
+    @staticmethod
+    def _is_healthy(smtp: smtplib.SMTP) -> bool:
+        """NOOP-ping a pooled connection before reuse"""
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_idle, name="smtp-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self) -> None:
+        """Close connections that have sat unused for longer than max_idle"""
+        while True:
+            time.sleep(60)
+            cutoff = time.monotonic() - self.max_idle
+            with self._lock:
+                stale = [smtp for smtp, released_at in self._available if released_at < cutoff]
+                self._available = [(smtp, t) for smtp, t in self._available if t >= cutoff]
+            for smtp in stale:
+                self._close(smtp)
+
+    def release(self, smtp: smtplib.SMTP) -> None:
+        """Return a connection to the pool, closing it if the pool is full"""
+        with self._lock:
+            if len(self._available) < self.max_size:
+                self._available.append((smtp, time.monotonic()))
+                return
+        self._close(smtp)
+
+    @contextmanager
+    def acquire(self):
+        """Yield a healthy logged-in connection and return it to the pool afterwards"""
+        smtp = None
+        with self._lock:
+            self._start_reaper()
+        while smtp is None:
+            with self._lock:
+                candidate = self._available.pop()[0] if self._available else None
+            if candidate is None:
+                smtp = self._connect()
+            elif self._is_healthy(candidate):
+                smtp = candidate
+            else:
+                self._close(candidate)
+
+        reusable = False
+        try:
+            yield smtp
+            reusable = True
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server refused this message; the logged-in session is still usable
+            reusable = True
+            raise
+        finally:
+            # Anything else (disconnects, socket errors) leaves the connection suspect
+            if reusable:
+                self.release(smtp)
+            else:
+                self._close(smtp)
+
+    def close_all(self) -> None:
+        """Close every pooled connection"""
+        with self._lock:
+            connections, self._available = self._available, []
+        for smtp, _ in connections:
+            self._close(smtp)